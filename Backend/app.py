@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 from datetime import timedelta
 load_dotenv()
 
+import click
+from sqlalchemy import inspect
 from flask import Flask, send_from_directory, jsonify
 from db import db
 from flask_jwt_extended import JWTManager
@@ -41,6 +43,10 @@ def create_app():
     CORS(app, origins=cors_origins, supports_credentials=True)
 
     # MOVE THIS IMPORT HERE TO AVOID CIRCULAR IMPORT
+    # Blueprints have to be registered before the first request, so they are
+    # imported here; their heavy dependencies (requests, markdown, xhtml2pdf)
+    # are imported inside the routes that use them. With gunicorn --preload
+    # this runs once in the master rather than in every worker.
     from routes.auth import auth_bp
     from routes.papers import paper_bp
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -63,21 +69,49 @@ def create_app():
     def uploaded_files(filename):
         return send_from_directory(os.path.join(app.root_path, 'uploads'), filename)
 
-    with app.app_context():
+    # Recompute the per-paper stats table from submissions, e.g. `flask rebuild-stats`
+    # after a manual data fix or to check the running counters are consistent.
+    @app.cli.command('rebuild-stats')
+    @click.option('--paper-id', type=int, default=None, help='Only rebuild stats for this paper.')
+    def rebuild_stats_command(paper_id):
+        from models.paper_stats import PaperStats
+        try:
+            count = PaperStats.rebuild(paper_id)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Rebuilt stats for {count} paper(s)")
+
+    # Schema setup is a one-time deploy step (`flask --app app init-db`), not
+    # something every gunicorn worker should repeat on boot.
+    @app.cli.command('init-db')
+    def init_db_command():
         try:
-            db.create_all()
-            # Create upload directory if it doesn't exist
-            os.makedirs(os.path.join(app.root_path, 'uploads/profile_pics'), exist_ok=True)
+            created = init_db(app)
         except Exception as e:
-            # If DATABASE_URL is not set or database is unavailable, log and continue.
-            # This allows the app to start on Render free tier (which may not have
-            # PostgreSQL provisioned yet). In production, DATABASE_URL must be set.
-            print(f"Warning: Could not initialize database: {e}")
-            print("Database will be created on first request that requires it.")
-        
+            # Workers no longer create tables, so a failed init must fail the deploy.
+            raise click.ClickException(f"Could not initialize database: {e}")
+        click.echo(f"Created tables: {', '.join(created)}" if created else "Database schema is up to date")
+
     return app
 
+def init_db(app):
+    """Create any missing tables and the upload directory. Returns the names of new tables.
+
+    This only creates tables that don't exist yet; it never alters existing
+    ones. Adding or changing a column on an existing table still needs a
+    manual ALTER TABLE (there is no migration tool in this project).
+    """
+    # Import every model so its table is registered on db.metadata
+    import models.user, models.question_paper, models.student_submission  # noqa: F401
+    import models.paper_stats, models.submission_draft  # noqa: F401
+    with app.app_context():
+        existing = set(inspect(db.engine).get_table_names())
+        db.create_all()
+        os.makedirs(os.path.join(app.root_path, 'uploads/profile_pics'), exist_ok=True)
+        return sorted(set(db.metadata.tables) - existing)
+
 app = create_app()
 
 if __name__ == '__main__':
+    init_db(app)
     app.run(debug=True)
@@ -0,0 +1,59 @@
+# benchmarks/startup_benchmark.py
+# Measures cold-start latency: the time from a fresh interpreter importing
+# `app` to the first request being answered, the same path a gunicorn worker
+# takes on Render. Each run is a separate subprocess so nothing is cached.
+#
+# Usage (from Backend/):
+#   python benchmarks/startup_benchmark.py [--runs 10] [--path /api/auth/ping]
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+from app import app
+t1 = time.perf_counter()
+resp = app.test_client().get({path!r})
+t2 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'first_request': t2 - t1, 'total': t2 - t0, 'status': resp.status_code}}))
+"""
+
+
+def run_once(path, env):
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD.format(path=path)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    # The app prints debug output; the timing line is the last one.
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import-to-first-request latency of the Flask app.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/api/auth/ping')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        # Use a throwaway database unless one is explicitly provided.
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        results = [run_once(args.path, env) for _ in range(args.runs)]
+
+    statuses = {r['status'] for r in results}
+    print(f"{args.runs} runs, GET {args.path} -> status {sorted(statuses)}")
+    for key in ('import', 'first_request', 'total'):
+        values = [r[key] * 1000 for r in results]
+        print(f"  {key:<14} median {statistics.median(values):8.1f} ms   "
+              f"min {min(values):8.1f} ms   max {max(values):8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
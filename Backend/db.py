@@ -1,7 +1,3 @@
 from flask_sqlalchemy import SQLAlchemy
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
 
 db = SQLAlchemy() 
\ No newline at end of file
@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+# Load the app once in the master and fork workers from it, so imports and
+# app setup happen a single time instead of once per worker.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+preload_app = True
+# Paper generation makes several Gemini calls per request; its own deadline
+# (GENERATION_DEADLINE_SECONDS) must stay below this.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+
+def post_fork(server, worker):
+    # Connections opened in the master (if any) must not be shared with the
+    # forked workers. close=False leaves the master's sockets alone and just
+    # gives this worker a fresh pool.
+    from app import app
+    from db import db
+    with app.app_context():
+        db.engine.dispose(close=False)
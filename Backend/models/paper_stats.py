@@ -0,0 +1,156 @@
+# models/paper_stats.py
+from db import db
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+# Same grading scale the evaluation prompt asks Gemini to follow.
+GRADES = ['A+', 'A', 'B+', 'B', 'C+', 'C', 'D', 'F']
+# Ten 10%-wide buckets: 0-9, 10-19, ..., 90-100 (100% lands in the last one).
+HISTOGRAM_BUCKETS = 10
+
+
+def evaluation_percentage(evaluation):
+    """Return the 0-100 score stored in an evaluation dict, or None if it has none."""
+    if not isinstance(evaluation, dict):
+        return None
+    try:
+        percentage = float(evaluation.get('percentage'))
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, min(100.0, percentage))
+
+
+def histogram_bucket(percentage):
+    return min(int(percentage // (100 / HISTOGRAM_BUCKETS)), HISTOGRAM_BUCKETS - 1)
+
+
+class PaperStats(db.Model):
+    """Running aggregates for one paper, kept in step with its submissions.
+
+    Every write path that touches a submission adjusts these counters in the
+    same transaction, so reading the stats never has to scan submissions.
+    """
+    __tablename__ = 'paper_stats'
+    question_paper_id = db.Column(db.Integer, db.ForeignKey('question_paper.id'), primary_key=True)
+    submission_count = db.Column(db.Integer, nullable=False, default=0)
+    evaluated_count = db.Column(db.Integer, nullable=False, default=0)
+    # Number of evaluated submissions that carried a usable percentage.
+    scored_count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    grade_counts = db.Column(db.JSON, nullable=False, default=dict)
+    histogram = db.Column(db.JSON, nullable=False, default=list)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def for_paper(cls, paper_id):
+        """Fetch the stats row for a paper (row-locked where supported), creating it if missing.
+
+        Rows are normally created together with the paper. A missing row means
+        the paper predates stats tracking, so it is seeded from the paper's
+        existing submissions. Call this before adding or changing a submission
+        in the current session, or the seed would already include that change.
+        """
+        stats = cls.query.filter_by(question_paper_id=paper_id).with_for_update().first()
+        if stats is not None:
+            return stats
+        try:
+            # A savepoint lets a concurrent insert of the same row win without
+            # rolling back the caller's transaction.
+            with db.session.begin_nested():
+                stats = cls(question_paper_id=paper_id)
+                stats.recompute()
+                db.session.add(stats)
+        except IntegrityError:
+            stats = cls.query.filter_by(question_paper_id=paper_id).with_for_update().first()
+        return stats
+
+    def reset(self):
+        self.submission_count = 0
+        self.evaluated_count = 0
+        self.scored_count = 0
+        self.score_sum = 0.0
+        self.grade_counts = {}
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def recompute(self):
+        """Reset the counters and replay every submission of this paper."""
+        from models.student_submission import StudentSubmission
+
+        self.reset()
+        submissions = StudentSubmission.query.filter_by(question_paper_id=self.question_paper_id).yield_per(500)
+        for s in submissions:
+            self.add_submission()
+            if s.evaluated:
+                self.replace_evaluation(None, s.evaluation)
+
+    def add_submission(self):
+        self.submission_count = (self.submission_count or 0) + 1
+
+    def replace_evaluation(self, old_evaluation, new_evaluation, was_evaluated=False):
+        """Swap one submission's contribution from its old evaluation to the new one."""
+        # JSON columns only notice reassignment, so work on copies and assign back.
+        grade_counts = dict(self.grade_counts or {})
+        histogram = list(self.histogram or [0] * HISTOGRAM_BUCKETS)
+
+        if was_evaluated:
+            self.evaluated_count = max((self.evaluated_count or 0) - 1, 0)
+            self._apply(old_evaluation, grade_counts, histogram, -1)
+        self.evaluated_count = (self.evaluated_count or 0) + 1
+        self._apply(new_evaluation, grade_counts, histogram, 1)
+
+        self.grade_counts = {g: n for g, n in grade_counts.items() if n > 0}
+        self.histogram = histogram
+
+    def _apply(self, evaluation, grade_counts, histogram, sign):
+        percentage = evaluation_percentage(evaluation)
+        if percentage is not None:
+            self.scored_count = max((self.scored_count or 0) + sign, 0)
+            self.score_sum = (self.score_sum or 0.0) + sign * percentage
+            bucket = histogram_bucket(percentage)
+            histogram[bucket] = max(histogram[bucket] + sign, 0)
+        grade = evaluation.get('grade') if isinstance(evaluation, dict) else None
+        if isinstance(grade, str) and grade.strip():
+            grade = grade.strip()
+            grade_counts[grade] = grade_counts.get(grade, 0) + sign
+
+    def to_dict(self):
+        bucket_width = 100 // HISTOGRAM_BUCKETS
+        histogram = self.histogram or [0] * HISTOGRAM_BUCKETS
+        grade_distribution = {g: 0 for g in GRADES}
+        grade_distribution.update(self.grade_counts or {})
+        return {
+            'paperId': self.question_paper_id,
+            'submissionCount': self.submission_count or 0,
+            'evaluatedCount': self.evaluated_count or 0,
+            'pendingCount': max((self.submission_count or 0) - (self.evaluated_count or 0), 0),
+            'averageScore': round(self.score_sum / self.scored_count, 2) if self.scored_count else None,
+            'gradeDistribution': grade_distribution,
+            'histogram': [{
+                'range': f"{i * bucket_width}-{100 if i == HISTOGRAM_BUCKETS - 1 else (i + 1) * bucket_width - 1}",
+                'count': histogram[i]
+            } for i in range(HISTOGRAM_BUCKETS)],
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+    @classmethod
+    def rebuild(cls, paper_id=None):
+        """Recompute stats from the submissions table. Returns the number of papers rebuilt.
+
+        Raises ValueError if paper_id is given but no such paper exists.
+        """
+        from models.question_paper import QuestionPaper
+
+        if paper_id is not None and QuestionPaper.query.get(paper_id) is None:
+            raise ValueError(f"Paper {paper_id} not found")
+        paper_ids = [paper_id] if paper_id is not None else [p.id for p in QuestionPaper.query.all()]
+        for pid in paper_ids:
+            stats = cls.query.filter_by(question_paper_id=pid).with_for_update().first()
+            if stats is None:
+                stats = cls(question_paper_id=pid)
+                db.session.add(stats)
+            stats.recompute()
+        # Drop rows left behind by papers that no longer exist.
+        if paper_id is None:
+            cls.query.filter(~cls.question_paper_id.in_(paper_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return len(paper_ids)
@@ -0,0 +1,33 @@
+# models/submission_draft.py
+from db import db
+from datetime import datetime
+import json
+import zlib
+
+
+class SubmissionDraft(db.Model):
+    """A student's in-progress answers for one paper, stored zlib-compressed."""
+    __tablename__ = 'submission_draft'
+    __table_args__ = (db.UniqueConstraint('question_paper_id', 'student_id', name='uq_draft_paper_student'),)
+    id = db.Column(db.Integer, primary_key=True)
+    question_paper_id = db.Column(db.Integer, db.ForeignKey('question_paper.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.LargeBinary, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def pack(answers):
+        return zlib.compress(json.dumps(answers, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def unpack(data):
+        return json.loads(zlib.decompress(data).decode('utf-8')) if data else {}
+
+    @property
+    def answers(self):
+        return self.unpack(self.data)
+
+    @answers.setter
+    def answers(self, value):
+        self.data = self.pack(value)
@@ -1,13 +1,15 @@
 # routes/papers.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
 from models.question_paper import QuestionPaper
 from db import db
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request, get_jwt
 from models.student_submission import StudentSubmission
+from models.paper_stats import PaperStats
+from models.submission_draft import SubmissionDraft
 from models.user import User
+from services import paper_render, draft_buffer
 from datetime import datetime
 import os
-import requests
 import json
 import traceback
 
@@ -16,6 +18,7 @@ papers_bp = Blueprint('papers', __name__)
 
 # Module-level helper to discover a generation-capable model for a given API key.
 def discover_generation_model(api_key):
+    import requests
     list_url = "https://generativelanguage.googleapis.com/v1beta/models"
     try:
         r = requests.get(list_url, params={"key": api_key}, timeout=20)
@@ -45,107 +48,24 @@ def discover_generation_model(api_key):
 @papers_bp.route('/generate-paper', methods=['POST'])
 @jwt_required()
 def generate_paper_route():
+    # Imported here rather than at module level: it pulls in `requests`, the
+    # most expensive import in the app, which only the Gemini routes need.
+    from services import paper_generation
     params = request.get_json()
-    prompt = f"""
-        Generate a comprehensive question paper with the following specifications:
-        
-        Subject: {params.get('subject')}
-        Class: {params.get('class')}
-        Total Marks: {params.get('totalMarks')}
-        Difficulty Level: {params.get('difficulty')}
-        Board: {params.get('board')}
-        Chapters: {', '.join(params.get('chapters', []))}
-        {f"Specific Topic: {params.get('specificTopic')}" if params.get('specificTopic') else ''}
-        {f"Special Instructions: {params.get('instructions')}" if params.get('instructions') else ''}
-        Paper Pattern: {params.get('paperPattern')}
-        
-        Please create a well-structured question paper in markdown format with:
-        1. Header with subject, class, time duration, and marks
-        2. Clear instructions for students
-        3. Questions divided by marks (1, 2, 3, 5, 10 marks etc.)
-        4. Proper numbering and formatting
-        5. Include a mix of question types based on the pattern specified
-        
-        Make sure the total marks add up to exactly {params.get('totalMarks')} marks.
-    """
-    
     try:
         gemini_api_key = os.environ.get('GEMINI_API_KEY')
         if not gemini_api_key:
             return jsonify({'error': 'GEMINI_API_KEY not configured'}), 500
         model_name = os.environ.get('GEMINI_MODEL', 'gemini-2.0-flash')
-        gemini_api_url = f"https://generativelanguage.googleapis.com/v1/models/{model_name}:generateContent"
 
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 2048,
-            }
-        }
-
-        response = None
-        try:
-            print(f"Attempting Gemini URL: {gemini_api_url}")
-            response = requests.post(gemini_api_url, params={"key": gemini_api_key}, json=payload, timeout=30)
-            response.raise_for_status()
-        
-        except requests.exceptions.HTTPError as he:
-            status = getattr(he.response, 'status_code', None)
-            print(f"HTTPError from {gemini_api_url}: {status} - {he}")
-            # Log response body for more details
-            if he.response is not None:
-                print(f"Error response: {he.response.text}")
-            msg = f"Gemini API HTTP error: {status}. Check GEMINI_API_KEY and model name."
-            print(msg)
-            return jsonify({'error': msg}), 502
-        except requests.exceptions.RequestException as e:
-            print(f"Gemini API Error: {e}")
-            return jsonify({'error': f"API request failed: {e}"}), 500
-
-        if response is None:
-            return jsonify({'error': "Failed to get response from Gemini API."}), 502
-
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            print(f"Gemini API Error: Failed to decode JSON from response. Response text: {response.text}")
-            return jsonify({'error': 'Failed to decode response from Gemini API.'}), 500
-        
-        # Enhanced error handling for Gemini response
-        if not data.get("candidates"):
-            # Check for a prompt feedback block if no candidates are returned
-            prompt_feedback = data.get("promptFeedback")
-            if prompt_feedback:
-                error_info = f"Content generation blocked. Reason: {prompt_feedback.get('blockReason')}. Safety ratings: {prompt_feedback.get('safetyRatings')}"
-                print(f"Gemini API Error: {error_info}")
-                return jsonify({'error': error_info}), 500
-            
-            # General error if no candidates and no specific feedback
-            print("Gemini API Error: No candidates in response and no prompt feedback.")
-            return jsonify({'error': 'Failed to generate content from Gemini API: No candidates in response.'}), 500
-
-        candidate = data["candidates"][0]
-        finish_reason = candidate.get("finishReason")
-        
-        if finish_reason and finish_reason != "STOP":
-            error_info = f"Content generation finished for a reason other than 'STOP'. Reason: {finish_reason}"
-            print(f"Gemini API Warning: {error_info}")
-            # Potentially return an error or handle as a partial response
-            # For now, we will still try to get content but log the warning.
-
-        if not (candidate.get("content") and candidate["content"].get("parts")):
-            print("Gemini API Error: Malformed response, 'content' or 'parts' missing.")
-            return jsonify({'error': 'Malformed response from Gemini API.'}), 500
-            
-        content = candidate["content"]["parts"][0].get("text", "")
+        # Sections are generated concurrently and continued on MAX_TOKENS, so
+        # long papers are neither truncated nor slower than a single section.
+        content = paper_generation.generate_paper(params, gemini_api_key, model_name)
         return jsonify({'content': content})
-        
-    except requests.exceptions.RequestException as e:
+
+    except paper_generation.GeminiError as e:
         print(f"Gemini API Error: {e}")
-        return jsonify({'error': f"API request failed: {e}"}), 500
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Unexpected Error: {e}")
         return jsonify({'error': f"Failed to generate question paper: {e}"}), 500
@@ -178,9 +98,16 @@ def create_paper():
         print("Paper object created")
         db.session.add(paper)
         print("Paper added to session")
+        # Create the stats row with the paper so submissions never race to insert it
+        db.session.flush()
+        stats = PaperStats(question_paper_id=paper.id)
+        stats.reset()
+        db.session.add(stats)
         db.session.commit()
         print("Paper committed to DB")
         print(f"Paper saved with ID: {paper.id}")
+        # Warm the render cache so the first print/download is a static file send.
+        paper_render.prerender_async(paper_render.paper_snapshot(paper))
         return jsonify({'message': 'Paper created', 'paper_id': paper.id})
     except Exception as e:
         print('Error creating paper:', repr(e))
@@ -246,6 +173,34 @@ def get_paper_by_id(paper_id):
         'createdAt': paper.created_at.isoformat()
     })
 
+@papers_bp.route('/papers/<int:paper_id>/render', methods=['GET'])
+@jwt_required()
+def render_paper(paper_id):
+    fmt = request.args.get('format', 'html').lower()
+    if fmt not in paper_render.FORMATS:
+        return jsonify({'error': f"Unsupported format '{fmt}'. Use one of: {', '.join(paper_render.FORMATS)}"}), 400
+    if fmt == 'pdf' and not paper_render.pdf_available():
+        return jsonify({'error': 'PDF rendering is not available on this server'}), 501
+    paper = QuestionPaper.query.get(paper_id)
+    if not paper:
+        return jsonify({'error': 'Paper not found'}), 404
+    snapshot = paper_render.paper_snapshot(paper)
+    try:
+        path = paper_render.get_rendered_path(snapshot, fmt)
+    except Exception as e:
+        print(f"Error rendering paper {paper_id} as {fmt}: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f"Failed to render paper: {e}"}), 500
+    return send_file(
+        path,
+        mimetype=paper_render.FORMATS[fmt],
+        as_attachment=(fmt == 'pdf'),
+        download_name=f"paper-{paper_id}.{fmt}",
+        etag=paper_render.cache_key(snapshot, fmt),
+        conditional=True,
+        max_age=0,
+    )
+
 @papers_bp.route('/test-debug', methods=['GET'])
 def test_debug():
     print("Test debug route hit")
@@ -266,8 +221,10 @@ def delete_paper(paper_id):
     paper = QuestionPaper.query.get(paper_id)
     if not paper:
         return jsonify({'error': 'Paper not found'}), 404
-    # Delete all related student submissions
+    # Delete all related student submissions, drafts and their aggregated stats
     StudentSubmission.query.filter_by(question_paper_id=paper_id).delete()
+    SubmissionDraft.query.filter_by(question_paper_id=paper_id).delete()
+    PaperStats.query.filter_by(question_paper_id=paper_id).delete()
     db.session.delete(paper)
     db.session.commit()
     return jsonify({'message': 'Paper and related submissions deleted'}), 200
@@ -277,6 +234,8 @@ def delete_paper(paper_id):
 def create_submission():
     data = request.get_json()
     try:
+        # Lock (or seed) the stats row before the new submission is in the session
+        stats = PaperStats.for_paper(data['question_paper_id'])
         submission = StudentSubmission(
             question_paper_id=data['question_paper_id'],
             student_id=data['student_id'],
@@ -287,9 +246,11 @@ def create_submission():
             evaluation=None
         )
         db.session.add(submission)
+        stats.add_submission()
         db.session.commit()
         return jsonify({'message': 'Submission saved', 'submission_id': submission.id}), 201
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
 @papers_bp.route('/submissions', methods=['GET'])
@@ -385,14 +346,102 @@ def update_submission_evaluation(submission_id):
     submission = StudentSubmission.query.get(submission_id)
     if not submission:
         return jsonify({'error': 'Submission not found'}), 404
+    stats = PaperStats.for_paper(submission.question_paper_id)
+    stats.replace_evaluation(submission.evaluation, data.get('evaluation'), was_evaluated=bool(submission.evaluated))
     submission.evaluation = data.get('evaluation')
     submission.evaluated = True
     db.session.commit()
     return jsonify({'message': 'Submission evaluation updated'})
 
+@papers_bp.route('/papers/<int:paper_id>/draft', methods=['GET'])
+@jwt_required()
+def get_draft(paper_id):
+    if not QuestionPaper.query.get(paper_id):
+        return jsonify({'error': 'Paper not found'}), 404
+    answers, version = draft_buffer.get_draft(paper_id, int(get_jwt_identity()))
+    return jsonify({'answers': answers, 'version': version})
+
+@papers_bp.route('/papers/<int:paper_id>/draft', methods=['PUT'])
+@jwt_required()
+def put_draft(paper_id):
+    data = request.get_json() or {}
+    base_version = data.get('version')
+    if not isinstance(base_version, int):
+        return jsonify({'error': 'version is required'}), 400
+    if not QuestionPaper.query.get(paper_id):
+        return jsonify({'error': 'Paper not found'}), 404
+    try:
+        version = draft_buffer.put_patch(paper_id, int(get_jwt_identity()), base_version, data.get('patch', {}))
+    except draft_buffer.DraftConflict as e:
+        return jsonify({'error': 'Draft version conflict', 'version': e.version, 'answers': e.answers}), 409
+    except draft_buffer.DraftClosed as e:
+        return jsonify({'error': str(e)}), 410
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error saving draft for paper {paper_id}: {e}")
+        return jsonify({'error': 'Failed to save draft'}), 503
+    return jsonify({'version': version})
+
+@papers_bp.route('/papers/<int:paper_id>/draft/submit', methods=['POST'])
+@jwt_required()
+def submit_draft(paper_id):
+    data = request.get_json(silent=True) or {}
+    student_id = int(get_jwt_identity())
+    if not QuestionPaper.query.get(paper_id):
+        return jsonify({'error': 'Paper not found'}), 404
+    if StudentSubmission.query.filter_by(question_paper_id=paper_id, student_id=student_id).first():
+        return jsonify({'error': 'Paper already submitted'}), 409
+    try:
+        draft = SubmissionDraft.query.filter_by(question_paper_id=paper_id, student_id=student_id).with_for_update().first()
+        if not draft:
+            return jsonify({'error': 'No draft to submit'}), 404
+        if 'version' in data and data['version'] != draft.version:
+            return jsonify({'error': 'Draft version conflict', 'version': draft.version, 'answers': draft.answers}), 409
+        stats = PaperStats.for_paper(paper_id)
+        student = User.query.get(student_id)
+        submission = StudentSubmission(
+            question_paper_id=paper_id,
+            student_id=student_id,
+            student_name=student.name if student else None,
+            answers=json.dumps(draft.answers),
+            submitted_at=datetime.utcnow(),
+            evaluated=False,
+            evaluation=None
+        )
+        db.session.add(submission)
+        stats.add_submission()
+        # Only delete the version that was read; an autosave committed in the
+        # meantime means the client must resync before submitting.
+        if not SubmissionDraft.query.filter_by(id=draft.id, version=draft.version).delete():
+            db.session.rollback()
+            answers, version = draft_buffer.get_draft(paper_id, student_id)
+            return jsonify({'error': 'Draft version conflict', 'version': version, 'answers': answers}), 409
+        db.session.commit()
+        return jsonify({'message': 'Submission saved', 'submission_id': submission.id}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@papers_bp.route('/papers/<int:paper_id>/stats', methods=['GET'])
+@jwt_required()
+def get_paper_stats(paper_id):
+    paper = QuestionPaper.query.get(paper_id)
+    if not paper:
+        return jsonify({'error': 'Paper not found'}), 404
+    if str(paper.created_by) != str(get_jwt_identity()):
+        return jsonify({'error': 'Unauthorized'}), 403
+    stats = PaperStats.query.get(paper_id)
+    if stats is None:
+        # Papers created before stats were tracked are seeded from their submissions.
+        stats = PaperStats.for_paper(paper_id)
+        db.session.commit()
+    return jsonify(stats.to_dict())
+
 @papers_bp.route('/evaluate-submission', methods=['POST'])
 @jwt_required()
 def evaluate_submission_route():
+    import requests
     data = request.get_json()
     question = data.get('question')
     student_answer = data.get('studentAnswer')
@@ -0,0 +1,129 @@
+# services/draft_buffer.py
+# Answer draft autosaves, applied as small deltas on top of the stored draft.
+#
+# Each PUT writes its own row with a conditional `UPDATE ... WHERE version =
+# <base version>` in the request's transaction. An earlier version queued
+# patches for a background writer that committed them in 200ms batches, but
+# gunicorn runs sync workers (one request at a time per worker), so a batch
+# never held more than one PUT and every autosave just waited out the window.
+# Coalescing happens on the client instead: SolvePaper debounces typing and
+# sends one patch every few seconds at most.
+#
+# The database is the only source of truth for draft versions, so concurrent
+# saves from different workers or tabs can't both produce the same version;
+# the loser gets a conflict and the client rebases on the stored copy.
+import re
+
+from sqlalchemy import update, insert
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.submission_draft import SubmissionDraft
+from models.student_submission import StudentSubmission
+
+MAX_ANSWER_CHARS = 50000
+MAX_ANSWERS = 500
+# Half of a UTF-16 surrogate pair; JSON can carry one but it can't be stored as UTF-8.
+_LONE_SURROGATE = re.compile('[\ud800-\udfff]')
+
+
+class DraftConflict(Exception):
+    """The client's base version is not the stored one; it must resync."""
+
+    def __init__(self, answers, version):
+        super().__init__(f"Draft is at version {version}")
+        self.answers = answers
+        self.version = version
+
+
+class DraftClosed(Exception):
+    """The paper has already been submitted, so its draft can't change."""
+
+
+def apply_patch(answers, patch):
+    """Return a copy of answers with a delta applied.
+
+    The patch maps question numbers to one of:
+      - a string: replace that answer,
+      - null: drop that answer,
+      - {"pos": int, "del": int, "ins": str}: splice the existing answer,
+        removing `del` characters at `pos` and inserting `ins` there.
+    Offsets count Unicode code points (the client splits answers with
+    Array.from to match), not UTF-16 units. Raises ValueError for malformed
+    patches, including text with unpaired surrogates.
+    """
+    if not isinstance(patch, dict):
+        raise ValueError('patch must be an object keyed by question number')
+    result = dict(answers)
+    for key, op in patch.items():
+        key = str(key)
+        if op is None:
+            result.pop(key, None)
+            continue
+        if isinstance(op, str):
+            value = op
+        elif isinstance(op, dict):
+            current = result.get(key, '')
+            pos, delete, insert_text = op.get('pos'), op.get('del', 0), op.get('ins', '')
+            if not (isinstance(pos, int) and isinstance(delete, int) and isinstance(insert_text, str)):
+                raise ValueError(f"invalid splice for question {key}")
+            if pos < 0 or delete < 0 or pos + delete > len(current):
+                raise ValueError(f"splice out of range for question {key}")
+            value = current[:pos] + insert_text + current[pos + delete:]
+        else:
+            raise ValueError(f"invalid patch value for question {key}")
+        if _LONE_SURROGATE.search(key) or _LONE_SURROGATE.search(value):
+            raise ValueError(f"answer to question {key!r} contains invalid characters")
+        if len(value) > MAX_ANSWER_CHARS:
+            raise ValueError(f"answer to question {key} is too long")
+        result[key] = value
+    if len(result) > MAX_ANSWERS:
+        raise ValueError('too many answers in draft')
+    return result
+
+
+def get_draft(paper_id, student_id):
+    row = SubmissionDraft.query.filter_by(question_paper_id=paper_id, student_id=student_id).first()
+    return (row.answers, row.version) if row else ({}, 0)
+
+
+def put_patch(paper_id, student_id, base_version, patch):
+    """Apply a delta on top of base_version, commit it and return the new version.
+
+    Raises DraftConflict, DraftClosed or ValueError (malformed patch).
+    """
+    if StudentSubmission.query.filter_by(question_paper_id=paper_id, student_id=student_id).first():
+        raise DraftClosed('Paper already submitted')
+    answers, version = get_draft(paper_id, student_id)
+    if base_version != version:
+        raise DraftConflict(answers, version)
+    answers = apply_patch(answers, patch)
+
+    try:
+        if version:
+            # Updates nothing if another request saved this draft since we read it.
+            result = db.session.execute(
+                update(SubmissionDraft)
+                .where(SubmissionDraft.question_paper_id == paper_id, SubmissionDraft.student_id == student_id,
+                       SubmissionDraft.version == version)
+                .values(data=SubmissionDraft.pack(answers), version=version + 1)
+            )
+            saved = result.rowcount == 1
+        else:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(SubmissionDraft).values(
+                        question_paper_id=paper_id, student_id=student_id,
+                        data=SubmissionDraft.pack(answers), version=1
+                    ))
+                saved = True
+            except IntegrityError:
+                saved = False
+        if not saved:
+            db.session.rollback()
+            raise DraftConflict(*get_draft(paper_id, student_id))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return version + 1
@@ -0,0 +1,305 @@
+# services/paper_generation.py
+# Generates long question papers section by section. Each mark value gets its
+# own Gemini call, the calls run concurrently, and any section that stops on
+# MAX_TOKENS is continued in a follow-up turn before the paper is stitched.
+import os
+import re
+import json
+import time
+import random
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+MARK_VALUES = [1, 2, 3, 5, 10]
+# Papers below this total are too short for a 10-mark section.
+MIN_TOTAL_FOR_LONG_ANSWERS = 30
+MAX_OUTPUT_TOKENS = 2048
+MAX_CONTINUATIONS = 3
+REQUEST_TIMEOUT = 30
+# Rate-limited (429) or overloaded (503) calls are retried with exponential
+# backoff, since one paper fans out into several concurrent calls.
+MAX_RATE_LIMIT_RETRIES = 3
+BACKOFF_BASE_SECONDS = 2
+MAX_BACKOFF_SECONDS = 20
+# Wall-clock budget for a whole paper, including continuations, backoffs and
+# the retry round. Keep it below gunicorn's worker timeout (120s in
+# gunicorn.conf.py) so the client gets a 504 GeminiError instead of a killed worker.
+GENERATION_DEADLINE_SECONDS = float(os.environ.get('GENERATION_DEADLINE_SECONDS', '100'))
+# Don't start a call (or the retry round) with less time left than this.
+MIN_CALL_SECONDS = 5
+SECTION_LABELS = 'ABCDEFGH'
+
+QUESTION_LINE = re.compile(r'^\s*(?:[#*_>]+\s*)*(?:Q(?:uestion)?\.?\s*)?(\d+)\s*[.):]', re.IGNORECASE | re.MULTILINE)
+
+
+class GeminiError(Exception):
+    """A Gemini call failed; status_code is what the route should answer with."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _time_left(deadline):
+    """Seconds until deadline (a time.monotonic() value); raise a 504 GeminiError if too few remain."""
+    remaining = deadline - time.monotonic()
+    if remaining < MIN_CALL_SECONDS:
+        raise GeminiError('Paper generation took too long. Please try again, or request fewer marks.', 504)
+    return remaining
+
+
+def plan_sections(total_marks):
+    """Split total_marks across mark values so the questions add up exactly.
+
+    Each mark value gets an equal share of the paper; whatever the integer
+    division leaves over becomes extra 1-mark questions.
+    """
+    values = [v for v in MARK_VALUES if v < 10 or total_marks >= MIN_TOTAL_FOR_LONG_ANSWERS]
+    share = total_marks / len(values)
+    counts = {v: int(share // v) for v in values}
+    counts[1] += total_marks - sum(v * n for v, n in counts.items())
+
+    sections = []
+    first_question = 1
+    for v in values:
+        if counts[v] <= 0:
+            continue
+        sections.append({
+            'label': SECTION_LABELS[len(sections)],
+            'marks': v,
+            'count': counts[v],
+            'first_question': first_question,
+        })
+        first_question += counts[v]
+    return sections
+
+
+def section_prompt(params, section):
+    last_question = section['first_question'] + section['count'] - 1
+    return f"""
+        Write Section {section['label']} of a question paper with the following specifications:
+
+        Subject: {params.get('subject')}
+        Class: {params.get('class')}
+        Difficulty Level: {params.get('difficulty')}
+        Board: {params.get('board')}
+        Chapters: {', '.join(params.get('chapters', []))}
+        {f"Specific Topic: {params.get('specificTopic')}" if params.get('specificTopic') else ''}
+        {f"Special Instructions: {params.get('instructions')}" if params.get('instructions') else ''}
+        Paper Pattern: {params.get('paperPattern')}
+
+        This section must contain exactly {section['count']} questions of {section['marks']} mark(s) each,
+        numbered {section['first_question']} to {last_question}.
+        Write each question on its own line starting with its number followed by a period (e.g. "{section['first_question']}.")
+        and end it with "[{section['marks']} mark{'s' if section['marks'] > 1 else ''}]".
+        Choose question types suited to {section['marks']}-mark questions and the paper pattern.
+
+        Output only the numbered questions in markdown. Do not write a paper header,
+        section heading, general instructions or answers.
+    """
+
+
+def call_gemini(contents, api_key, model_name, deadline, temperature=0.7):
+    """POST one generateContent request and return (text, finish_reason).
+
+    The request timeout and any rate-limit backoff are capped so the call
+    never runs past deadline.
+    """
+    gemini_api_url = f"https://generativelanguage.googleapis.com/v1/models/{model_name}:generateContent"
+    payload = {
+        "contents": contents,
+        "generationConfig": {
+            "temperature": temperature,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": MAX_OUTPUT_TOKENS,
+        }
+    }
+    attempt = 0
+    while True:
+        try:
+            timeout = min(REQUEST_TIMEOUT, _time_left(deadline))
+            response = requests.post(gemini_api_url, params={"key": api_key}, json=payload, timeout=timeout)
+            response.raise_for_status()
+            break
+        except requests.exceptions.HTTPError as he:
+            status = getattr(he.response, 'status_code', None)
+            print(f"HTTPError from {gemini_api_url}: {status} - {he}")
+            if he.response is not None:
+                print(f"Error response: {he.response.text}")
+            if status in (429, 503):
+                if attempt < MAX_RATE_LIMIT_RETRIES:
+                    delay = _retry_delay(he.response, attempt)
+                    if delay + MIN_CALL_SECONDS > deadline - time.monotonic():
+                        raise GeminiError('Paper generation took too long (Gemini API rate limited). Please try again in a minute.', 504)
+                    attempt += 1
+                    print(f"Gemini API busy ({status}), retrying in {delay:.1f}s ({attempt}/{MAX_RATE_LIMIT_RETRIES})")
+                    time.sleep(delay)
+                    continue
+                raise GeminiError("Gemini API rate limit reached. Please try again in a minute.", 429)
+            raise GeminiError(f"Gemini API HTTP error: {status}. Check GEMINI_API_KEY and model name.", 502)
+        except requests.exceptions.RequestException as e:
+            print(f"Gemini API Error: {e}")
+            if isinstance(e, requests.exceptions.Timeout) and deadline - time.monotonic() < MIN_CALL_SECONDS:
+                raise GeminiError('Paper generation took too long. Please try again, or request fewer marks.', 504)
+            raise GeminiError(f"API request failed: {e}", 500)
+
+    try:
+        data = response.json()
+    except json.JSONDecodeError:
+        print(f"Gemini API Error: Failed to decode JSON from response. Response text: {response.text}")
+        raise GeminiError('Failed to decode response from Gemini API.', 500)
+
+    if not data.get("candidates"):
+        prompt_feedback = data.get("promptFeedback")
+        if prompt_feedback:
+            raise GeminiError(f"Content generation blocked. Reason: {prompt_feedback.get('blockReason')}. "
+                              f"Safety ratings: {prompt_feedback.get('safetyRatings')}", 500)
+        raise GeminiError('Failed to generate content from Gemini API: No candidates in response.', 500)
+
+    candidate = data["candidates"][0]
+    if not (candidate.get("content") and candidate["content"].get("parts")):
+        raise GeminiError('Malformed response from Gemini API.', 500)
+    text = ''.join(part.get("text", "") for part in candidate["content"]["parts"])
+    return text, candidate.get("finishReason")
+
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before retrying: Retry-After if Gemini sent one, else jittered exponential backoff."""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return min(float(retry_after), MAX_BACKOFF_SECONDS)
+    except (TypeError, ValueError):
+        return min(BACKOFF_BASE_SECONDS * 2 ** attempt, MAX_BACKOFF_SECONDS) * random.uniform(0.75, 1.25)
+
+
+def generate_section(params, section, api_key, model_name, deadline):
+    """Generate one section, continuing in follow-up turns while Gemini hits MAX_TOKENS."""
+    prompt = section_prompt(params, section)
+    contents = [{"role": "user", "parts": [{"text": prompt}]}]
+    text, finish_reason = call_gemini(contents, api_key, model_name, deadline)
+
+    continuations = 0
+    while finish_reason == "MAX_TOKENS" and continuations < MAX_CONTINUATIONS:
+        continuations += 1
+        print(f"Section {section['label']} hit MAX_TOKENS, continuing ({continuations}/{MAX_CONTINUATIONS})")
+        contents = [
+            {"role": "user", "parts": [{"text": prompt}]},
+            {"role": "model", "parts": [{"text": text}]},
+            {"role": "user", "parts": [{"text": "Continue exactly where you stopped. Do not repeat anything already written."}]},
+        ]
+        more, finish_reason = call_gemini(contents, api_key, model_name, deadline)
+        text += more
+
+    if finish_reason and finish_reason not in ("STOP", "MAX_TOKENS"):
+        print(f"Gemini API Warning: section {section['label']} finished with reason {finish_reason}")
+    if finish_reason == "MAX_TOKENS":
+        print(f"Gemini API Warning: section {section['label']} still truncated after {MAX_CONTINUATIONS} continuations")
+    return text.strip()
+
+
+def normalize_section(section, text):
+    """Return the section text with exactly section['count'] questions, or None if it has too few.
+
+    Every numbered question line counts, whatever its number. Extra questions
+    are cut off and the rest are renumbered in order, so the section's marks
+    match the plan.
+    """
+    matches = list(QUESTION_LINE.finditer(text))
+    if len(matches) < section['count']:
+        return None
+    if len(matches) > section['count']:
+        print(f"Section {section['label']}: trimming {len(matches) - section['count']} extra question(s)")
+        text = text[:matches[section['count']].start()].rstrip()
+        matches = matches[:section['count']]
+    # Renumber back to front so earlier offsets stay valid.
+    for i in reversed(range(len(matches))):
+        start, end = matches[i].span(1)
+        text = text[:start] + str(section['first_question'] + i) + text[end:]
+    return text
+
+
+def paper_duration(total_marks):
+    if total_marks <= 25:
+        return '1 Hour'
+    if total_marks <= 50:
+        return '2 Hours'
+    return '3 Hours'
+
+
+def stitch_paper(params, total_marks, sections, texts):
+    lines = [
+        f"# {params.get('subject')} Question Paper",
+        '',
+        f"**Class:** {params.get('class')}  ",
+        f"**Board:** {params.get('board')}  ",
+        f"**Time:** {paper_duration(total_marks)}  ",
+        f"**Maximum Marks:** {total_marks}",
+        '',
+        '## General Instructions',
+        '',
+        f"1. This question paper contains {sum(s['count'] for s in sections)} questions "
+        f"divided into {len(sections)} sections.",
+        '2. All questions are compulsory.',
+        '3. Marks for each question are indicated against it.',
+    ]
+    if params.get('instructions'):
+        lines.append(f"4. {params.get('instructions')}")
+    for section, text in zip(sections, texts):
+        section_marks = section['marks'] * section['count']
+        lines += [
+            '',
+            f"## Section {section['label']} ({section['count']} x {section['marks']} "
+            f"mark{'s' if section['marks'] > 1 else ''} = {section_marks} marks)",
+            '',
+            text,
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def generate_paper(params, api_key, model_name):
+    """Generate a full paper, one concurrent Gemini call per section."""
+    try:
+        total_marks = int(params.get('totalMarks'))
+    except (TypeError, ValueError):
+        raise GeminiError('totalMarks must be a positive integer', 400)
+    if total_marks <= 0:
+        raise GeminiError('totalMarks must be a positive integer', 400)
+
+    deadline = time.monotonic() + GENERATION_DEADLINE_SECONDS
+    sections = plan_sections(total_marks)
+    texts = [None] * len(sections)
+    errors = [None] * len(sections)
+
+    def attempt(indices):
+        with ThreadPoolExecutor(max_workers=len(indices)) as pool:
+            futures = {i: pool.submit(generate_section, params, sections[i], api_key, model_name, deadline)
+                       for i in indices}
+        for i, future in futures.items():
+            try:
+                texts[i] = normalize_section(sections[i], future.result())
+                errors[i] = None
+            except GeminiError as e:
+                print(f"Section {sections[i]['label']} failed: {e}")
+                errors[i] = e
+
+    attempt(range(len(sections)))
+    # Sections that failed or came back with too few questions get one more attempt.
+    missing = [i for i in range(len(sections)) if texts[i] is None]
+    if missing:
+        _time_left(deadline)
+        print(f"Regenerating sections {[sections[i]['label'] for i in missing]}")
+        attempt(missing)
+
+    for i, section in enumerate(sections):
+        if texts[i] is None:
+            if errors[i] is not None:
+                raise errors[i]
+            raise GeminiError(f"Section {section['label']} did not contain {section['count']} questions "
+                              f"of {section['marks']} mark(s) after a retry. Please try again.", 502)
+
+    marks = sum(s['marks'] * len(QUESTION_LINE.findall(t)) for s, t in zip(sections, texts))
+    if marks != total_marks:
+        raise GeminiError(f"Generated questions add up to {marks} marks instead of {total_marks}. Please try again.", 502)
+
+    return stitch_paper(params, total_marks, sections, texts)
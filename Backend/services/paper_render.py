@@ -0,0 +1,254 @@
+# services/paper_render.py
+# Server-side rendering of question papers into print-ready HTML/PDF, with an
+# on-disk cache keyed by a hash of everything that affects the output.
+import io
+import os
+import re
+import hashlib
+import threading
+import traceback
+import importlib.util
+
+from markupsafe import escape
+
+# markdown and xhtml2pdf (which pulls in reportlab) are imported on first
+# render rather than at app import, to keep worker startup cheap.
+# PDF output is optional; HTML still works without xhtml2pdf.
+_PDF_AVAILABLE = importlib.util.find_spec('xhtml2pdf') is not None
+
+# Bump when the template or CSS changes so stale artifacts stop matching.
+RENDER_VERSION = '3'
+FORMATS = {
+    'html': 'text/html',
+    'pdf': 'application/pdf',
+}
+
+CACHE_DIR = os.environ.get(
+    'RENDER_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'papers')
+)
+CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_MB', '200')) * 1024 * 1024
+
+_cache_lock = threading.Lock()
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+  @page {{ size: A4; margin: 18mm 16mm; }}
+  body {{ font-family: "Times New Roman", Times, serif; font-size: 12pt; line-height: 1.45; color: #000; }}
+  .paper-header {{ text-align: center; border-bottom: 2px solid #000; padding-bottom: 6pt; margin-bottom: 12pt; }}
+  .paper-header h1 {{ font-size: 18pt; margin: 0 0 4pt 0; }}
+  .paper-meta {{ width: 100%; font-size: 11pt; }}
+  .paper-meta td {{ padding: 2pt 0; }}
+  .paper-meta .right {{ text-align: right; }}
+  h1, h2, h3 {{ page-break-after: avoid; }}
+  h2 {{ font-size: 14pt; margin-top: 14pt; }}
+  h3 {{ font-size: 12pt; }}
+  table {{ border-collapse: collapse; }}
+  .paper-body table td, .paper-body table th {{ border: 1px solid #000; padding: 3pt 5pt; }}
+  li {{ page-break-inside: avoid; }}
+</style>
+</head>
+<body>
+<div class="paper-header">
+  <h1>{subject}</h1>
+  <table class="paper-meta">
+    <tr><td>Class: {class_name}</td><td class="right">Maximum Marks: {total_marks}</td></tr>
+    <tr><td>Board: {board}</td><td class="right">Difficulty: {difficulty}</td></tr>
+    {time_row}
+  </table>
+</div>
+<div class="paper-body">
+{body}
+</div>
+</body>
+</html>
+"""
+
+
+def paper_snapshot(paper):
+    """Copy the fields rendering needs off a QuestionPaper so it can cross threads."""
+    return {
+        'id': paper.id,
+        'subject': paper.subject,
+        'class_name': paper.class_name,
+        'total_marks': paper.total_marks,
+        'difficulty': paper.difficulty,
+        'board': paper.board,
+        'content': paper.content,
+    }
+
+
+def pdf_available():
+    return _PDF_AVAILABLE
+
+
+def cache_key(snapshot, fmt):
+    h = hashlib.sha256()
+    for part in (RENDER_VERSION, fmt, snapshot['subject'], snapshot['class_name'], snapshot['total_marks'],
+                 snapshot['difficulty'], snapshot['board'], snapshot['content']):
+        h.update(str(part if part is not None else '').encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+# Link/image targets allowed in rendered papers; anything else (javascript:,
+# data:, vbscript:, ...) is dropped.
+SAFE_URL_SCHEMES = ('http', 'https', 'mailto')
+
+
+def markdown_to_safe_html(text):
+    """Convert paper markdown to HTML without letting raw HTML or script URLs through.
+
+    Paper content comes from teachers and from Gemini and is served as
+    text/html, so raw HTML is escaped as literal text instead of passed through.
+    """
+    import markdown
+    from urllib.parse import urlsplit
+
+    class _SafeUrls(markdown.treeprocessors.Treeprocessor):
+        def run(self, root):
+            for el in root.iter():
+                for attr in ('href', 'src'):
+                    url = el.get(attr)
+                    if url is None:
+                        continue
+                    # Browsers ignore control characters and whitespace inside schemes.
+                    scheme = urlsplit(''.join(ch for ch in url if ch > ' ')).scheme.lower()
+                    if scheme and scheme not in SAFE_URL_SCHEMES:
+                        del el.attrib[attr]
+
+    md = markdown.Markdown(extensions=['tables', 'sane_lists'])
+    md.preprocessors.deregister('html_block')
+    md.inlinePatterns.deregister('html')
+    md.treeprocessors.register(_SafeUrls(md), 'safe_urls', 0)
+    return md.convert(text)
+
+
+# The header block paper content opens with: a top-level title followed by
+# a few metadata lines, up to the first sub-heading, bold-only heading line
+# (e.g. "**General Instructions:**"), rule or numbered question.
+HEADER_MAX_LINES = 15
+_HEADER_END = re.compile(
+    r'^\s*(#{2,}\s|\*\*[^*]+\*\*:?\s*$|[-*_]{3,}\s*$|(?:Q(?:uestion)?\.?\s*)?\d+\s*[.):])', re.IGNORECASE
+)
+_HEADER_TIME = re.compile(r'\bTime[^:|\n]*:[\s*_]*([^|*\n]+?)\s*(?:\||\*|$)', re.IGNORECASE | re.MULTILINE)
+
+
+def split_header(content):
+    """Split the leading title/metadata block off paper markdown.
+
+    Generated papers start with their own "# Subject ... / Class / Marks"
+    header, which the page template already prints. Returns (header, body);
+    header is '' when the content doesn't open with a level-1 heading or no
+    end of the block is found within HEADER_MAX_LINES.
+    """
+    lines = content.split('\n')
+    first = next((i for i, line in enumerate(lines) if line.strip()), None)
+    if first is None or not re.match(r'^\s*#\s', lines[first]):
+        return '', content
+    for i in range(first + 1, min(len(lines), first + HEADER_MAX_LINES)):
+        if _HEADER_END.match(lines[i]):
+            return '\n'.join(lines[:i]), '\n'.join(lines[i:])
+    return '', content
+
+
+def render_html(snapshot):
+    header, content = split_header(snapshot['content'] or '')
+    body = markdown_to_safe_html(content)
+    # The time allowed only exists in the content's own header; keep it.
+    time_match = _HEADER_TIME.search(header)
+    time_row = f'<tr><td>Time: {escape(time_match.group(1))}</td><td></td></tr>' if time_match else ''
+    return PAGE_TEMPLATE.format(
+        time_row=time_row,
+        title=escape(f"{snapshot['subject'] or 'Question Paper'} - Class {snapshot['class_name'] or ''}"),
+        subject=escape(snapshot['subject'] or 'Question Paper'),
+        class_name=escape(snapshot['class_name'] or '-'),
+        total_marks=escape(snapshot['total_marks'] if snapshot['total_marks'] is not None else '-'),
+        board=escape(snapshot['board'] or '-'),
+        difficulty=escape(snapshot['difficulty'] or '-'),
+        body=body,
+    )
+
+
+def render_pdf(snapshot):
+    if not _PDF_AVAILABLE:
+        raise RuntimeError('PDF rendering is not available: install xhtml2pdf')
+    from xhtml2pdf import pisa
+    out = io.BytesIO()
+    result = pisa.CreatePDF(render_html(snapshot), dest=out, encoding='utf-8')
+    if result.err:
+        raise RuntimeError(f"PDF rendering failed with {result.err} error(s)")
+    return out.getvalue()
+
+
+def _evict(keep_path):
+    """Drop least recently used artifacts until the cache fits in CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name.startswith('.') or not os.path.isfile(path):
+            continue
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        if path == keep_path:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+
+def get_rendered_path(snapshot, fmt):
+    """Return the path of the cached artifact for a paper, rendering it on a miss.
+
+    Cache hits refresh the file's mtime, which is what eviction orders by.
+    """
+    path = os.path.join(CACHE_DIR, f"{cache_key(snapshot, fmt)}.{fmt}")
+    if os.path.exists(path):
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass  # evicted between the check and the touch; render again
+
+    data = render_html(snapshot).encode('utf-8') if fmt == 'html' else render_pdf(snapshot)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write to a temp file and rename so readers never see a partial artifact.
+    tmp_path = os.path.join(CACHE_DIR, f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    with _cache_lock:
+        _evict(path)
+    return path
+
+
+def prerender_async(snapshot):
+    """Render every available format for a freshly created paper in the background."""
+    def work():
+        for fmt in FORMATS:
+            if fmt == 'pdf' and not pdf_available():
+                continue
+            try:
+                get_rendered_path(snapshot, fmt)
+            except Exception as e:
+                print(f"Background render of paper {snapshot['id']} ({fmt}) failed: {e}")
+                traceback.print_exc()
+
+    thread = threading.Thread(target=work, name=f"render-paper-{snapshot['id']}", daemon=True)
+    thread.start()
+    return thread
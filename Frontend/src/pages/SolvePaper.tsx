@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
@@ -16,6 +16,32 @@ interface ParsedQuestion {
   marks?: string;
 }
 
+type AnswerPatch = { [key: string]: string | null | { pos: number; del: number; ins: string } };
+
+const AUTOSAVE_DELAY_MS = 3000;
+
+// Build the smallest single splice per changed answer so autosaves only send what was typed.
+// Splice offsets count Unicode code points, which is how the server indexes
+// answers; splitting with Array.from keeps surrogate pairs (emoji, math
+// letters) together where plain string indexing would count UTF-16 units.
+const diffAnswers = (saved: { [key: string]: string }, current: { [key: string]: string }): AnswerPatch => {
+  const patch: AnswerPatch = {};
+  Object.keys(current).forEach(key => {
+    if ((saved[key] || '') === (current[key] || '')) return;
+    const before = Array.from(saved[key] || '');
+    const after = Array.from(current[key] || '');
+    let start = 0;
+    while (start < before.length && start < after.length && before[start] === after[start]) start++;
+    let end = 0;
+    while (
+      end < before.length - start && end < after.length - start &&
+      before[before.length - 1 - end] === after[after.length - 1 - end]
+    ) end++;
+    patch[key] = { pos: start, del: before.length - start - end, ins: after.slice(start, after.length - end).join('') };
+  });
+  return patch;
+};
+
 const SolvePaper = () => {
   const { paperId } = useParams<{ paperId: string }>();
   const [user, setUser] = useState(authService.getAuthState().user);
@@ -24,6 +50,10 @@ const SolvePaper = () => {
   const [questions, setQuestions] = useState<ParsedQuestion[]>([]);
   const [answers, setAnswers] = useState<{[key: string]: string}>({});
   const [isSubmitting, setIsSubmitting] = useState(false);
+  const draftVersion = useRef(0);
+  const savedAnswers = useRef<{[key: string]: string}>({});
+  const latestAnswers = useRef<{[key: string]: string}>({});
+  const autosaveTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
   const navigate = useNavigate();
   const { theme, toggleTheme } = useTheme();
   const { toast } = useToast();
@@ -134,6 +164,18 @@ const SolvePaper = () => {
         parsedQuestions.forEach(q => {
           initialAnswers[q.number] = '';
         });
+        // Restore any autosaved draft on top of the empty answer fields
+        try {
+          const draftResponse = await API.get(`/papers/${paperId}/draft`, {
+            headers: { Authorization: `Bearer ${authService.getToken()}` }
+          });
+          draftVersion.current = draftResponse.data.version;
+          savedAnswers.current = draftResponse.data.answers || {};
+          Object.assign(initialAnswers, savedAnswers.current);
+        } catch (error) {
+          console.error('Error loading draft:', error);
+        }
+        latestAnswers.current = initialAnswers;
         setAnswers(initialAnswers);
       } catch (error) {
         toast({
@@ -147,11 +189,51 @@ const SolvePaper = () => {
     fetchPaper();
   };
 
+  const saveDraft = async (retryOnConflict = true): Promise<boolean> => {
+    if (autosaveTimer.current) {
+      clearTimeout(autosaveTimer.current);
+      autosaveTimer.current = null;
+    }
+    const current = latestAnswers.current;
+    const patch = diffAnswers(savedAnswers.current, current);
+    if (Object.keys(patch).length === 0) return true;
+    try {
+      const response = await API.put(`/papers/${paperId}/draft`, {
+        version: draftVersion.current,
+        patch
+      }, {
+        headers: { Authorization: `Bearer ${authService.getToken()}` }
+      });
+      draftVersion.current = response.data.version;
+      savedAnswers.current = current;
+      return true;
+    } catch (error: any) {
+      if (error.response?.status === 409) {
+        // Someone else (another tab) saved first: rebase on the server copy and retry once
+        draftVersion.current = error.response.data.version;
+        savedAnswers.current = error.response.data.answers || {};
+        if (retryOnConflict) return saveDraft(false);
+      }
+      console.error('Error autosaving draft:', error);
+      return false;
+    }
+  };
+
+  useEffect(() => () => {
+    if (autosaveTimer.current) clearTimeout(autosaveTimer.current);
+  }, []);
+
   const handleAnswerChange = (questionNumber: string, value: string) => {
-    setAnswers(prev => ({
-      ...prev,
-      [questionNumber]: value
-    }));
+    setAnswers(prev => {
+      const next = {
+        ...prev,
+        [questionNumber]: value
+      };
+      latestAnswers.current = next;
+      return next;
+    });
+    if (autosaveTimer.current) clearTimeout(autosaveTimer.current);
+    autosaveTimer.current = setTimeout(() => { saveDraft(); }, AUTOSAVE_DELAY_MS);
   };
 
   const handleSubmit = async () => {
@@ -168,13 +250,13 @@ const SolvePaper = () => {
 
     setIsSubmitting(true);
     try {
-      const submissionData = JSON.stringify(answers);
+      // Save the last edits, then let the server turn the draft into a submission
+      if (!(await saveDraft())) {
+        throw new Error('Could not save your latest answers. Please check your connection and try again.');
+      }
       const token = authService.getToken();
-      const response = await API.post('/submissions', {
-        question_paper_id: paperId,
-        student_id: String(user!.id),
-        student_name: user!.name,
-        answers: submissionData
+      const response = await API.post(`/papers/${paperId}/draft/submit`, {
+        version: draftVersion.current
       }, {
         headers: {
           'Content-Type': 'application/json',